@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
+from contextlib import contextmanager
 import copy
+import functools
 import getopt
 import io
 import json
@@ -14,7 +16,7 @@ except ImportError:
 import shutil
 import subprocess
 import sys
-from tempfile import mkstemp
+from tempfile import mkdtemp, mkstemp
 import time
 from threading import Thread
 import traceback
@@ -37,6 +39,9 @@ Parameters
             configuration file.
 --enterprise-enabled
 -e          Enable the enterprise migration scripts as well.
+--enterprise-jobs JOBS
+            The number of parallel jobs to dump and restore the database
+            with during enterprise upgrades. Defaults to the number of CPUs.
 --start-version VERSION
 -f VERSION  Start migration from a database of this Odoo version. This could
             prevent pre-migration scripts from running.
@@ -46,7 +51,22 @@ Parameters
 -o          Disable the open-upgrade builds and upgrades.
 --production
 -p          Run the migration for production purposes.
+--profile   Profile the database instead of migrating it: report the largest
+            tables, bloated indexes, attachments in the database and the
+            filestore, and the tables known to make the upgrades to the
+            coming versions slow. Recommends hooks to enable, and writes
+            the report to logfile/migration-profile.json. Runs ANALYZE on
+            the database first, as the row counts and the index bloat are
+            estimated from its statistics. This only updates the planner's
+            statistics, but takes a while on a large database, like
+            listing all files of a large filestore does.
 -r          Rebuild all builds before running the migration.
+--rehearse PERCENT
+            Rehearse the migration on a sample of the database, that keeps
+            PERCENT percent of the partners and journal entries and all
+            configuration. The database is moved aside meanwhile and the
+            migrated sample is kept as DATABASE-rehearsal. The time each
+            step took is extrapolated to the full database.
 --reset-progress VERSION[:openupgrade]
             Don't take into account the progress that is specified with this
             option and beyond. The migration will start from here if progress
@@ -62,11 +82,61 @@ SCRIPT_PATH = os.path.abspath(os.path.dirname(__file__))
 WAFT_DIR = os.path.realpath(os.path.join(SCRIPT_PATH, "../.."))
 MIGRATION_PATH = WAFT_DIR + "/migration"
 
+# Tables that a rehearsal keeps a sample of, in this order. The rows referenced
+# by the given columns are always kept.
+REHEARSAL_SAMPLED_TABLES = [
+    ("res_partner", [("res_users", "partner_id"), ("res_company", "partner_id")]),
+    ("account_invoice", []),
+    ("account_move", [("account_invoice", "move_id")]),
+]
+
+# Tables that are known to make the upgrade to a version slow when they are large
+PROFILE_SLOW_TABLES = {
+    "11.0": {
+        "stock_quant": "Quants are merged, and their history is dropped.",
+        "stock_quant_move_rel": "Quants are merged, and their history is dropped.",
+    },
+    "13.0": {
+        "account_invoice": "Invoices become journal entries.",
+        "account_invoice_line": "Invoice lines become journal items.",
+        "account_move_line": "Journal items get the fields of invoice lines.",
+    },
+    "14.0": {
+        "account_payment": "Payments become journal entries.",
+        "account_bank_statement_line": "Bank statement lines become journal entries.",
+    },
+    "16.0": {
+        "ir_translation": "Translations move into JSONB columns of their tables.",
+        "mail_tracking_value": "Tracked fields are referred to by id instead of name.",
+    },
+}
+PROFILE_MAIL_TABLES = [
+    "mail_followers",
+    "mail_mail",
+    "mail_message",
+    "mail_message_res_partner_needaction_rel",
+    "mail_notification",
+    "mail_tracking_value",
+]
+# From these sizes on, tables and attachments are reported as large
+PROFILE_LARGE_ROWS = 1000000
+PROFILE_LARGE_SIZE = 1024**3
+PROFILE_LARGE_ATTACHMENTS = 100 * 1024**2
+# Indexes of at least this size, of which at least this part is estimated to be
+# bloat, are reported as bloated
+PROFILE_BLOAT_MIN_SIZE = 10 * 1024**2
+PROFILE_BLOAT_RATIO = 0.5
+# From this number of records of uninstalled modules on, database-cleanup.py
+# is recommended
+PROFILE_STALE_RECORDS = 1000
+
 # Global variables
 params = {}
 progress = {}
+progress_filename = "progress.json"
 db_version = None
 enterprise_script_filepath = None
+step_timings = []
 
 
 class CommandFailedException(Exception):
@@ -87,6 +157,34 @@ class CommandFailedException(Exception):
         )
 
 
+def timed(label: str):
+    """
+    Record how long every call of the decorated migration step takes.
+
+    :param label: The name of the step, formatted with the version argument.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(version, *args, **kwargs):
+            with timed_step(label % version):
+                return function(version, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def timed_step(label: str):
+    """Record how long the enclosed migration step takes."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        step_timings.append((label, time.time() - start))
+
+
 def available_enterprise_build_versions(start_version, minimum_target):
     """
     Get a list of all Odoo versions which need a build folder for the migration.
@@ -233,10 +331,19 @@ def copy_database(database: str, new_database: str, move_fs: bool = False):
     except CommandFailedException:
         pass
     cmd('createdb "' + new_database + '" -T "' + database + '"')
+    copy_filestore(database, new_database, move_fs)
+
+
+def copy_filestore(database: str, new_database: str, move_fs: bool = False):
+    """
+    Copy the filestore of a database to the one of a new database.
 
-    filestore_dir = os.path.join(os.environ["HOME"], ".local/share/Odoo/filestore/")
-    filestore = os.path.join(filestore_dir, database)
-    new_filestore = os.path.join(filestore_dir, new_database)
+    :param database: The database of which to copy the filestore.
+    :param new_database: The name of the new database.
+    :param move_fs: Whether to move the filestore rather than copy it.
+    """
+    filestore = filestore_path(database)
+    new_filestore = filestore_path(new_database)
     if os.path.exists(filestore):
         if os.path.exists(new_filestore):
             cmd(["rm", "-r", new_filestore])
@@ -248,6 +355,20 @@ def copy_database(database: str, new_database: str, move_fs: bool = False):
         logging.warning("No filestore for %s to copy to %s." % (database, new_database))
 
 
+def count_rows(database: str):
+    """Estimate the number of rows in all tables of the database."""
+    with psycopg.connect("dbname=" + database) as conn:
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+            cur.execute(
+                """
+                SELECT COALESCE(SUM(GREATEST(reltuples, 0)), 0) FROM pg_class
+                WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace
+                """
+            )
+            return int(cur.fetchone()[0])
+
+
 def cmd(
     command: list[str],
     input_: str | None = None,
@@ -338,6 +459,14 @@ def cmd_system(command: str):
         raise CommandFailedException(command, exit_code)
 
 
+def database_exists(database: str):
+    """Check whether a database exists."""
+    with psycopg.connect("dbname=postgres") as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", [database])
+            return bool(cur.fetchone())
+
+
 def defuse_database():
     """
     Disable some stuff in the database.
@@ -366,6 +495,11 @@ def defuse_database():
                         raise e
 
 
+def filestore_path(database: str):
+    """The filestore folder of the database."""
+    return os.path.join(os.environ["HOME"], ".local/share/Odoo/filestore", database)
+
+
 def find_db_version_from_progress():
     """Extract the current Odoo version of the database from the current progress."""
     highest_version = params["start-version"]
@@ -416,17 +550,23 @@ def load_defaults(parameters):
         "MIGRATION_ENTERPRISE_JUMP_TO", ENTERPRISE_MINIMUM_TARGET
     )
     no_backups = is_environ_bool_true("MIGRATION_NO_BACKUPS")
+    enterprise_jobs = int(
+        os.environ.get("MIGRATION_ENTERPRISE_JOBS", os.cpu_count() or 1)
+    )
     return {
         **{
             "enterprise-autotrust-ssh": False,
             "enterprise-dont-resume": False,
             "enterprise-enabled": enterprise_enabled,
+            "enterprise-jobs": enterprise_jobs,
             "enterprise-jump-to": minimum_target,
             "help": False,
             "no-backups": no_backups,
             "open-upgrade-disabled": open_upgrade_disabled,
             "production": False,
+            "profile": False,
             "rebuild": False,
+            "rehearse": False,
             "reset-progress": False,
             "restore": False,
             "skip-initial-upgrade": skip_initial_upgrade,
@@ -507,7 +647,7 @@ def load_progress():
         ("post-migration", True, True),
     ]
 
-    progress_filepath = os.path.join(WAFT_DIR, "progress.json")
+    progress_filepath = os.path.join(WAFT_DIR, progress_filename)
     if not os.path.exists(progress_filepath):
         return {}
     with open(progress_filepath, "r") as file:
@@ -589,6 +729,22 @@ def mark_script_executed(version, hook_name, script_path):
     return True
 
 
+def move_database(database: str, new_database: str):
+    """
+    Rename the database and move its filestore, unlike rename_database without
+    dropping a database or filestore that has the new name already.
+    """
+    if database_exists(new_database) or os.path.exists(filestore_path(new_database)):
+        raise Exception(
+            'Not moving "%s" to "%s", which exists already.' % (database, new_database)
+        )
+    with psycopg.connect("dbname=postgres") as conn:
+        with conn.cursor() as cur:
+            cur.execute('ALTER DATABASE "%s" RENAME TO "%s"' % (database, new_database))
+    if os.path.exists(filestore_path(database)):
+        shutil.move(filestore_path(database), filestore_path(new_database))
+
+
 def parse_arguments():
     """Parse the command line arguments."""
     arguments = {}
@@ -611,6 +767,9 @@ def parse_arguments():
                 "enterprise-autotrust-ssh",
                 "open-upgrade-disabled",
                 "enterprise-jump-to=",
+                "enterprise-jobs=",
+                "rehearse=",
+                "profile",
             ],
         )
     except getopt.GetoptError as err:
@@ -632,8 +791,12 @@ def parse_arguments():
             arguments["open-upgrade-disabled"] = True
         if arg == "-p" or arg == "--production":
             arguments["production"] = True
+        if arg == "--profile":
+            arguments["profile"] = True
         if arg == "-r" or arg == "--rebuild":
             arguments["rebuild"] = True
+        if arg == "--rehearse":
+            arguments["rehearse"] = float(value)
         if arg == "--reset-progress":
             arguments["reset-progress"] = value.split(":")[:2]
         if arg == "-s" or arg == "--restore":
@@ -646,6 +809,8 @@ def parse_arguments():
             arguments["enterprise-autotrust-ssh"] = True
         if arg == "--enterprise-jump-to":
             arguments["enterprise-jump-to"] = value
+        if arg == "--enterprise-jobs":
+            arguments["enterprise-jobs"] = int(value)
     return arguments
 
 
@@ -726,6 +891,298 @@ with OdooEnvironment(database=db_name) as env:
     return cmd(exec_path, header)
 
 
+def profile_database(start_version, target_version):
+    """
+    Profile the data volume of the database, to find what will make the migration
+    slow before running it.
+
+    The report, with the hooks that are recommended to enable, is logged and
+    written to logfile/migration-profile.json.
+    """
+    database = os.environ["PGDATABASE"]
+    versions = available_build_versions(start_version)[1:]
+    logging.info("Profiling database %s...", database)
+
+    with psycopg.connect("dbname=" + database) as conn:
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+            cur.execute("SELECT pg_database_size(current_database())")
+            database_size = cur.fetchone()[0]
+            cur.execute(
+                """
+                SELECT relname, GREATEST(reltuples, 0)::bigint,
+                    pg_total_relation_size(oid), pg_relation_size(oid),
+                    pg_indexes_size(oid)
+                FROM pg_class
+                WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace
+                ORDER BY 3 DESC
+                """
+            )
+            tables = {
+                row[0]: {
+                    "rows": row[1],
+                    "size": row[2],
+                    "table_size": row[3],
+                    "index_size": row[4],
+                }
+                for row in cur.fetchall()
+            }
+
+            # A btree index tuple takes an 8 byte header, the aligned key and a
+            # 4 byte line pointer, and leaf pages are filled up to 90%. Indexes
+            # on expressions have no statistics of their key, and are skipped.
+            cur.execute(
+                """
+                SELECT ic.relname, c.relname, pg_relation_size(ic.oid),
+                    GREATEST(ic.reltuples, 0), (
+                        SELECT SUM(s.avg_width) FROM pg_attribute a
+                        JOIN pg_stats s ON s.schemaname = 'public'
+                            AND s.tablename = c.relname AND s.attname = a.attname
+                        WHERE a.attrelid = c.oid AND a.attnum = ANY (i.indkey)
+                    )
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indrelid
+                JOIN pg_class ic ON ic.oid = i.indexrelid
+                JOIN pg_am am ON am.oid = ic.relam
+                WHERE c.relnamespace = 'public'::regnamespace
+                    AND am.amname = 'btree' AND NOT 0 = ANY (i.indkey)
+                    AND pg_relation_size(ic.oid) >= %s
+                """,
+                [PROFILE_BLOAT_MIN_SIZE],
+            )
+            bloated_indexes = []
+            for index, table, size, rows, key_width in cur.fetchall():
+                if key_width is None:
+                    continue
+                expected = rows * (12 + -(-key_width // 8) * 8) / 0.9
+                if size - expected >= size * PROFILE_BLOAT_RATIO:
+                    bloated_indexes.append(
+                        {
+                            "index": index,
+                            "table": table,
+                            "size": size,
+                            "estimated_bloat": int(size - expected),
+                        }
+                    )
+            bloated_indexes.sort(key=lambda index: -index["estimated_bloat"])
+            cur.execute(
+                """
+                SELECT ic.relname, c.relname FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indrelid
+                JOIN pg_class ic ON ic.oid = i.indexrelid
+                WHERE c.relnamespace = 'public'::regnamespace AND NOT i.indisvalid
+                """
+            )
+            invalid_indexes = [
+                {"index": row[0], "table": row[1]} for row in cur.fetchall()
+            ]
+
+            cur.execute(
+                """
+                SELECT COUNT(*), COALESCE(SUM(file_size), 0) FROM ir_attachment
+                WHERE db_datas IS NOT NULL
+                """
+            )
+            db_attachments = cur.fetchone()
+            cur.execute(
+                """
+                SELECT COUNT(*), COALESCE(SUM(file_size), 0) FROM ir_attachment
+                WHERE store_fname IS NOT NULL
+                """
+            )
+            filestore_attachments = cur.fetchone()
+            # Attachments with the same content share their file
+            cur.execute(
+                """
+                SELECT DISTINCT store_fname FROM ir_attachment
+                WHERE store_fname IS NOT NULL
+                """
+            )
+            store_fnames = {row[0] for row in cur.fetchall()}
+
+            # Records of models and views that are left behind by modules that
+            # are not installed anymore. Exported records are not of a module.
+            cur.execute(
+                """
+                SELECT d.model, COUNT(*) FROM ir_model_data d
+                LEFT JOIN ir_module_module m ON m.name = d.module
+                WHERE LEFT(d.module, 2) != '__'
+                    AND (m.state IS NULL OR m.state != 'installed')
+                GROUP BY d.model
+                """
+            )
+            stale_records = dict(cur.fetchall())
+
+    filestore = filestore_path(database)
+    filestore_files = {}
+    for dirpath, _dirnames, filenames in os.walk(filestore):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            filestore_files[os.path.relpath(path, filestore)] = os.path.getsize(path)
+    attachments = {
+        "database": {"count": db_attachments[0], "size": int(db_attachments[1])},
+        "filestore": {
+            "count": filestore_attachments[0],
+            "size": int(filestore_attachments[1]),
+            "files": len(filestore_files),
+            "size_on_disk": sum(filestore_files.values()),
+            "missing_files": len(store_fnames - set(filestore_files)),
+            "unreferenced_files": len(set(filestore_files) - store_fnames),
+        },
+    }
+
+    def is_large(table):
+        return table in tables and (
+            tables[table]["rows"] >= PROFILE_LARGE_ROWS
+            or tables[table]["size"] >= PROFILE_LARGE_SIZE
+        )
+
+    slow_tables = [
+        {"version": version, "table": table, "reason": reason, **tables[table]}
+        for version in versions
+        for table, reason in PROFILE_SLOW_TABLES.get(version, {}).items()
+        if is_large(table)
+    ]
+
+    # The common hooks that are linked to for all versions, or any on the way
+    enabled_hooks = set()
+    hook_dirs = [os.path.join(MIGRATION_PATH, "hook")] + [
+        os.path.join(MIGRATION_PATH, "build-" + version, "hook")
+        for version in available_build_versions(start_version)
+    ]
+    for hook_dir in hook_dirs:
+        for dirpath, _dirnames, filenames in os.walk(hook_dir):
+            for filename in filenames:
+                if filename.endswith(".link"):
+                    with open(os.path.join(dirpath, filename)) as file:
+                        enabled_hooks.add(file.read().strip())
+    recommendations = []
+
+    def recommend(reason, hook=None):
+        recommendation = {"reason": reason, "hook": hook}
+        if hook:
+            if hook in enabled_hooks:
+                return
+            link = "hook/pre-migration/10-%s.link" % os.path.splitext(hook)[0]
+            recommendation["enable"] = "echo %s > migration/%s" % (hook, link)
+        recommendations.append(recommendation)
+
+    if stale_records.get("ir.model"):
+        recommend(
+            "%i models of uninstalled modules are left." % stale_records["ir.model"],
+            "clean-models.py",
+        )
+    if stale_records.get("ir.ui.view"):
+        recommend(
+            "%i views of uninstalled modules are left." % stale_records["ir.ui.view"],
+            "clean-views.py",
+        )
+    if sum(stale_records.values()) >= PROFILE_STALE_RECORDS:
+        recommend(
+            "%i records of uninstalled modules are left."
+            % sum(stale_records.values()),
+            "database-cleanup.py",
+        )
+    if invalid_indexes:
+        recommend(
+            "%i indexes are invalid: %s."
+            % (
+                len(invalid_indexes),
+                ", ".join(index["index"] for index in invalid_indexes),
+            ),
+            "fix-indexes.py",
+        )
+    if bloated_indexes:
+        recommend(
+            "%i indexes are bloated, by %i MB in total. REINDEX their tables "
+            "before the migration: %s."
+            % (
+                len(bloated_indexes),
+                sum(index["estimated_bloat"] for index in bloated_indexes) // 1024**2,
+                ", ".join(sorted({index["table"] for index in bloated_indexes})),
+            )
+        )
+    if attachments["database"]["size"] >= PROFILE_LARGE_ATTACHMENTS:
+        recommend(
+            "%i MB of attachments is stored in the database, it makes every copy "
+            "of the database slower. Move them to the filestore before the "
+            "migration, with env['ir.attachment'].force_storage() in a "
+            "pre-migration hook." % (attachments["database"]["size"] // 1024**2)
+        )
+    if attachments["filestore"]["missing_files"]:
+        recommend(
+            "%i files of attachments are missing in %s."
+            % (attachments["filestore"]["missing_files"], filestore)
+        )
+    for table in PROFILE_MAIL_TABLES:
+        if is_large(table):
+            recommend(
+                "%s has %i rows (%i MB). Purge old records in a pre-migration hook, "
+                "like the ones of build-16.0/hook/pre-upgrade do for mail tables."
+                % (table, tables[table]["rows"], tables[table]["size"] // 1024**2)
+            )
+    for slow_table in slow_tables:
+        recommend(
+            "The upgrade to %s will be slow on %s, with %i rows (%i MB): %s"
+            % (
+                slow_table["version"],
+                slow_table["table"],
+                slow_table["rows"],
+                slow_table["size"] // 1024**2,
+                slow_table["reason"],
+            )
+        )
+
+    logging.info("Database size: %i MB", database_size // 1024**2)
+    logging.info("Largest tables:")
+    for table, values in list(tables.items())[:10]:
+        logging.info(
+            "%10i MB %12i rows  %s", values["size"] // 1024**2, values["rows"], table
+        )
+    logging.info(
+        "Attachments: %i in the database (%i MB), %i in the filestore (%i MB)",
+        attachments["database"]["count"],
+        attachments["database"]["size"] // 1024**2,
+        attachments["filestore"]["count"],
+        attachments["filestore"]["size_on_disk"] // 1024**2,
+    )
+    for recommendation in recommendations:
+        logging.warning(recommendation["reason"])
+        if recommendation["hook"]:
+            logging.warning(
+                "  Enable %s: %s", recommendation["hook"], recommendation["enable"]
+            )
+    if not recommendations:
+        logging.info("Nothing stands out that would make the migration slow.")
+
+    with open(os.path.join(WAFT_DIR, "logfile/migration-profile.json"), "w") as file:
+        json.dump(
+            {
+                "database": database,
+                "start_version": start_version,
+                "target_version": target_version,
+                "database_size": database_size,
+                "tables": [
+                    {"table": table, **values}
+                    for table, values in list(tables.items())[:50]
+                ],
+                "mail_tables": {
+                    table: tables[table]
+                    for table in PROFILE_MAIL_TABLES
+                    if table in tables
+                },
+                "bloated_indexes": bloated_indexes,
+                "invalid_indexes": invalid_indexes,
+                "attachments": attachments,
+                "stale_records": stale_records,
+                "slow_tables": slow_tables,
+                "recommendations": recommendations,
+            },
+            file,
+            indent=2,
+        )
+
+
 def rebuild_sources():
     """
     (Re)build all Waft build folders that are part of this migration build.
@@ -996,6 +1453,57 @@ def rebuild_sources():
             cmd_system('echo "running_env = dev" >> "' + build_dir + '/auto/odoo.conf"')
 
 
+def rehearse_migration(start_version, target_version):
+    """
+    Run the whole migration on a sample of the database, and extrapolate its timing.
+
+    The database is moved aside while a sample of it takes its name, so that all
+    build folders work on the sample as they are. The migrated sample is kept as
+    "<database>-rehearsal", and the progress in progress-rehearsal.json.
+    """
+    global progress, progress_filename
+
+    database = os.environ["PGDATABASE"]
+    full_database = database + "-rehearsal-full"
+    rehearsal_database = database + "-rehearsal"
+    progress_filename = "progress-rehearsal.json"
+    progress = {}
+    progress_filepath = os.path.join(WAFT_DIR, progress_filename)
+    if os.path.exists(progress_filepath):
+        os.remove(progress_filepath)
+    params["no-backups"] = True
+
+    # Left by a rehearsal that was interrupted, and holding the real database
+    if database_exists(full_database) or os.path.exists(filestore_path(full_database)):
+        raise Exception(
+            '"%s" or its filestore exists already. It can be the database of a '
+            "rehearsal that was interrupted: rename it back to \"%s\" if so, "
+            "or else remove it." % (full_database, database)
+        )
+    full_rows = count_rows(database)
+    logging.info(
+        'Moving "%s" aside as "%s" during the rehearsal...', database, full_database
+    )
+    move_database(database, full_database)
+    try:
+        copy_database(full_database, database)
+        sample_database(database, params["rehearse"], start_version)
+        sample_rows = count_rows(database)
+        logging.info(
+            "The sample has %i of the %i rows of the database.", sample_rows, full_rows
+        )
+        try:
+            run_migration(start_version, target_version)
+        finally:
+            report_rehearsal(full_rows / max(sample_rows, 1))
+    finally:
+        if database_exists(database):
+            rename_database(database, rehearsal_database)
+            copy_filestore(database, rehearsal_database, move_fs=True)
+        logging.info('Moving "%s" back to "%s"...', full_database, database)
+        move_database(full_database, database)
+
+
 def rename_database(database, new_database):
     """Rename the database."""
     try:
@@ -1007,6 +1515,36 @@ def rename_database(database, new_database):
             cur.execute('ALTER DATABASE "%s" RENAME TO "%s"' % (database, new_database))
 
 
+def report_rehearsal(ratio: float):
+    """
+    Log how long each step of the rehearsal took, and how long it would take on the
+    full database, assuming that the time scales with the number of rows.
+
+    The report is written to logfile/migration-rehearsal.json as well.
+    """
+    logging.info("Rehearsal timings, extrapolated %.1f times:", ratio)
+    steps = []
+    for label, seconds in step_timings:
+        logging.info("%10.0fs %10.0fs  %s", seconds, seconds * ratio, label)
+        steps.append(
+            {"step": label, "seconds": seconds, "extrapolated_seconds": seconds * ratio}
+        )
+    total = sum(seconds for _label, seconds in step_timings)
+    logging.info("%10.0fs %10.0fs  Total", total, total * ratio)
+    with open(os.path.join(WAFT_DIR, "logfile/migration-rehearsal.json"), "w") as file:
+        json.dump(
+            {
+                "ratio": ratio,
+                "seconds": total,
+                "extrapolated_seconds": total * ratio,
+                "steps": steps,
+            },
+            file,
+            indent=2,
+        )
+
+
+@timed("Enterprise upgrade to %s")
 def run_enterprise_upgrade(version: str):
     """
     Run Odoo's official enterprise migration script.
@@ -1049,9 +1587,7 @@ def run_enterprise_upgrade(version: str):
         return False
 
     enterprise_database = os.environ["PGDATABASE"] + "-" + version + "-enterprise"
-    enterprise_filestore = os.path.join(
-        os.environ["HOME"], ".local/share/Odoo/filestore/", enterprise_database
-    )
+    enterprise_filestore = filestore_path(enterprise_database)
     try:
         cmd(
             'dropdb "' + enterprise_database + '"',
@@ -1079,77 +1615,118 @@ def run_enterprise_upgrade(version: str):
     logfile.seek(0, io.SEEK_END)
     # tty = open('/dev/tty', 'r')
     mode = "production" if params["production"] else "test"
-    while not done:
-        if attempts == 10:
-            raise Exception("Enterprise upgrade failed, too many attempts.")
-        attempts += 1
 
-        try:
-            proc = subprocess.Popen(
-                [
-                    "python3",
-                    enterprise_script_filepath,
-                    "--debug",
-                    mode,
-                    "-d",
-                    os.environ["PGDATABASE"],
-                    "-t",
-                    version,
-                ],
-                stdin=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
+    # Have the script dump and restore in parallel, and dump only once when it
+    # has to be run again
+    pg_parallel_dir = mkdtemp("-pg-parallel")
+    for program in ("pg_dump", "pg_restore"):
+        os.symlink(
+            os.path.join(SCRIPT_PATH, "pg-parallel"),
+            os.path.join(pg_parallel_dir, program),
+        )
+    dump_cache_dir = os.path.join(WAFT_DIR, "auto", enterprise_database + "-dump")
+    cmd(["rm", "-rf", dump_cache_dir])
+    os.makedirs(dump_cache_dir)
+    env = {
+        **os.environ,
+        "PATH": pg_parallel_dir + os.pathsep + os.environ["PATH"],
+        "PG_PARALLEL_DUMP_CACHE": dump_cache_dir,
+        "PG_PARALLEL_JOBS": str(params["enterprise-jobs"]),
+    }
+    try:
+        while not done:
+            if attempts == 10:
+                raise Exception("Enterprise upgrade failed, too many attempts.")
+            attempts += 1
 
-            # Keep reading the logfile until the process has exitted.
-            while True:
-                line = logfile.readline()
-                if not line:
-                    try:
-                        if check_process_status(proc):
-                            done = True
+            try:
+                proc = subprocess.Popen(
+                    [
+                        "python3",
+                        enterprise_script_filepath,
+                        "--debug",
+                        mode,
+                        "-d",
+                        os.environ["PGDATABASE"],
+                        "-t",
+                        version,
+                    ],
+                    stdin=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    env=env,
+                )
+
+                # Keep reading the logfile until the process has exitted.
+                while True:
+                    line = logfile.readline()
+                    if not line:
+                        try:
+                            if check_process_status(proc):
+                                done = True
+                                break
+                            else:
+                                time.sleep(1)
+                                continue
+                        except TimeoutError:
+                            logging.warning("Timeout error, retrying...")
                             break
-                        else:
-                            time.sleep(1)
-                            continue
-                    except TimeoutError:
+
+                    if line.find("Error: Upgrade server communication error") != -1:
                         logging.warning("Timeout error, retrying...")
                         break
-
-                if line.find("Error: Upgrade server communication error") != -1:
-                    logging.warning("Timeout error, retrying...")
-                    break
-                elif (
-                    line.find(
-                        "This upgrade request seems to have been "
-                        "interrupted. Do you want to resume it? "
-                        "[Y/n]"
-                    )
-                    != -1
-                ):
-                    if answer == "Y":
-                        logging.info("Resuming enterprise upgrade request...")
-                    else:
-                        logging.info("Restarting enterprise upgrade request...")
-                    proc.stdin.write((answer + "\n").encode("utf-8"))
-                    proc.stdin.flush()
-                    answer = "Y"
-        finally:
-            proc.kill()
+                    elif (
+                        line.find(
+                            "This upgrade request seems to have been "
+                            "interrupted. Do you want to resume it? "
+                            "[Y/n]"
+                        )
+                        != -1
+                    ):
+                        if answer == "Y":
+                            logging.info("Resuming enterprise upgrade request...")
+                        else:
+                            logging.info("Restarting enterprise upgrade request...")
+                        proc.stdin.write((answer + "\n").encode("utf-8"))
+                        proc.stdin.flush()
+                        answer = "Y"
+            finally:
+                proc.kill()
+    finally:
+        shutil.rmtree(pg_parallel_dir)
+        cmd(["rm", "-rf", dump_cache_dir])
 
     mark_enterprise_done(version)
+    # Copying the restored database would take as long as restoring it did, so
+    # it is moved in place of the original one instead
+    database = os.environ["PGDATABASE"]
     try:
-        if not params["no-backups"]:
-            copy_database(enterprise_database, os.environ["PGDATABASE"], True)
-        else:
-            rename_database(enterprise_database, os.environ["PGDATABASE"])
-    except CommandFailedException as e:
+        rename_database(enterprise_database, database)
+    except (CommandFailedException, psycopg.Error) as e:
         logging.error(
             "Failed because we weren't able to get the enterprise database in "
             "place of the original one. No worries, the migrated database "
             "still exists, but someone needs to resolve the error, execute "
-            "the following command, and restart the migration script:\n"
-            f"createdb \"{os.environ['PGDATABASE']}\" -T "
-            f'"{enterprise_database}"'
+            "the following commands, and restart the migration script:\n"
+            f'dropdb --if-exists "{database}"\n'
+            f"psql -d postgres -c 'ALTER DATABASE \"{enterprise_database}\" "
+            f'RENAME TO "{database}"\'\n'
+            f'rm -rf "{filestore_path(database)}"\n'
+            f'mv "{enterprise_filestore}" "{filestore_path(database)}"'
+        )
+        raise e
+    try:
+        copy_filestore(enterprise_database, database, True)
+    except CommandFailedException as e:
+        # The database is the migrated one already, only its filestore is left
+        logging.error(
+            "Failed because we weren't able to move the filestore of the "
+            "enterprise database in place of the original one. The migrated "
+            f'database is "{database}" already, but its filestore is still '
+            f'"{enterprise_filestore}". Someone needs to resolve the error, '
+            "execute the following commands, which replace the filestore of the "
+            "original database, and restart the migration script:\n"
+            f'rm -rf "{filestore_path(database)}"\n'
+            f'mv "{enterprise_filestore}" "{filestore_path(database)}"'
         )
         raise e
 
@@ -1384,7 +1961,9 @@ def run_scripts(version: str, hook_name: str, run_at_version: str | None = None)
         if not check_script_support(script_path, run_at_version):
             continue
 
-        if not run_script(script_path, run_at_version):
+        with timed_step("%s %s: %s" % (version, hook_name, script_filename)):
+            executed = run_script(script_path, run_at_version)
+        if not executed:
             logging.error(
                 "Unknown file extension for script " + script_filename + ", skipping..."
             )
@@ -1393,6 +1972,7 @@ def run_scripts(version: str, hook_name: str, run_at_version: str | None = None)
         mark_script_executed(version, hook_name, script_path)
 
 
+@timed("OpenUpgrade to %s")
 def run_upgrade(version):
     """Run a full upgrade to the given Odoo version."""
     instance = os.environ["PGDATABASE"] + "-" + version
@@ -1439,13 +2019,96 @@ def run_upgrade(version):
             raise e
 
 
+def sample_database(database: str, percentage: float, version: str):
+    """
+    Thin out a database to a percentage of its partners and journal entries.
+
+    Rows that depend on a dropped row are dropped as well, or lose the reference
+    when it is optional, following the foreign keys like the migrationapi purges
+    do. Configuration, and the partners of users and companies, are kept. This runs
+    in the build of the given version, which has psycopg2 and the migrationapi.
+    """
+    build_dir = (
+        WAFT_DIR
+        if version == os.environ["ODOO_VERSION"] and float(version) >= 14.0
+        else MIGRATION_PATH + "/build-" + version
+    )
+    logging.info(
+        "Sampling %s%% of %s...",
+        percentage,
+        ", ".join(table for table, _kept_references in REHEARSAL_SAMPLED_TABLES),
+    )
+    script = """
+from __future__ import print_function
+import logging
+import sys
+
+import psycopg2
+from migrationapi import Purger
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    stream=sys.stderr,
+    format='%%(message)s'
+)
+
+
+class DictCursor(object):
+    \"\"\"A plain psycopg2 cursor with the part of Odoo's cursor API that the
+    migrationapi needs.\"\"\"
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def dictfetchall(self):
+        columns = [column[0] for column in self._cursor.description]
+        return [dict(zip(columns, row)) for row in self._cursor.fetchall()]
+
+
+conn = psycopg2.connect(dbname=%r)
+try:
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT table_name FROM information_schema.tables "
+        "WHERE table_schema = 'public'"
+    )
+    tables = set(row[0] for row in cur.fetchall())
+    cur.execute("SELECT setseed(0)")
+    for table, kept_references in %r:
+        if table not in tables:
+            continue
+        where_clause = "random() >= %%f" %% %r
+        for referencing_table, column in kept_references:
+            if referencing_table in tables:
+                where_clause += (
+                    ' AND id NOT IN (SELECT "%%s" FROM "%%s" WHERE "%%s" IS NOT NULL)'
+                    %% (column, referencing_table, column)
+                )
+        with Purger(DictCursor(cur), table) as purger:
+            purger.purge(where_clause)
+    conn.commit()
+finally:
+    conn.close()
+""" % (
+        database,
+        REHEARSAL_SAMPLED_TABLES,
+        percentage / 100.0,
+    )
+
+    exec_path = os.path.join(build_dir, ".venv/bin/python")
+    return cmd(exec_path, script)
+
+
 def save_progress():
     """
     Write all the progress information from the global variable into a file.
 
     It is the progress.json file in the main Waft build directory.
     """
-    progress_filepath = os.path.join(WAFT_DIR, "progress.json")
+    progress_filepath = os.path.join(WAFT_DIR, progress_filename)
     with open(progress_filepath, "w") as file:
         json.dump(progress, file, indent=2)
 
@@ -1516,9 +2179,17 @@ def main():
             else params["start-version"]
         )
         target_version = os.environ["ODOO_VERSION"]
+        if params["profile"]:
+            profile_database(start_version, target_version)
+            logging.info("Profile completed.")
+            return 0
         logging.info(
             "Starting migration from %s to %s...", start_version, target_version
         )
+        if params["rehearse"]:
+            rehearse_migration(start_version, target_version)
+            logging.info("Rehearsal completed.")
+            return 0
         run_migration(start_version, target_version)
         logging.info("Migration completed.")
     except Exception as e:
@@ -6,7 +6,10 @@ import sys
 import getopt
 import polib
 import shutil
+import sqlite3
+import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from waftlib import (
     ODOO_DIR,
     ADDONS_DIR,
@@ -17,6 +20,10 @@ SCRIPT_PATH = os.path.abspath(os.path.dirname(__file__))
 os.environ['ODOO_WORK_DIR'] = os.path.realpath(os.path.join(SCRIPT_PATH, "../.."))
 load_dotenv(os.path.join(os.environ["ODOO_WORK_DIR"], ".env-secret"))
 
+CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'waft', 'translate-modules'
+)
+
 HELP_TEXT = """
 This script will generate new .po files for certain modules, and certain
 or all of its languages. The script try to prefill the translations with either
@@ -32,6 +39,9 @@ Parameters
             in .env-shared or .env-secret .
 --help
 -h          Show this help message.
+--jobs N
+-j N        Number of modules to export at the same time. Each export starts
+            its own Odoo process. Defaults to the number of CPUs, at most 4.
 --languages LANGS
 -l LANGS    A comma-seperated list of languages to process exclusively.
 --module NAME
@@ -40,24 +50,52 @@ Parameters
 -f NAME     Specifies the name of the folder in custom/src, for which it will
             process the modules contained therein exclusively.
 --use-translation-service
--t          Use the DeepL translation service to translate any missing
-            translations.
+-t          Use a translation service to translate any missing
+            translations. Translations are remembered in a local translation
+            memory, so every text is only sent to the service once.
+--translation-backend NAME
+-b NAME     The translation service to use with -t: 'deepl' (default) or
+            'pseudo'. The latter only marks texts with their language and
+            never leaves the machine, which is meant for trying this script.
+--batch-chars N
+            Maximum number of characters sent in one request (default 20000).
+--max-requests N
+            Maximum number of requests running at the same time (default 2).
 --key key
 -k key      To override 'DEEPL_SECRET' environment variable and specify
             DeepL api authorization key.
 """
 
 arguments = {}
-compendium = {}
+compendium = None
 deepl = None
-temp_file = None
-temp_dir = None
 translator = None
 
 
-def complete_missing_translations(pofile, lang):
-    global arguments, compendium
+class TranslationError(Exception):
+    pass
+
+
+class TranslationBackend:
+    """A translation service. Backends translate a list of texts to one
+    language, and raise TranslationError when they can't."""
+
+    name = None
+
+    def translate(self, texts, lang):
+        raise TranslationError(
+            "Translation backend %s is unable to translate to %s" %
+            (self.name, lang)
+        )
 
+
+class DeepLBackend(TranslationBackend):
+    name = 'deepl'
+
+    def __init__(self, auth_key):
+        self.translator = deepl.Translator(auth_key)
+
+    @staticmethod
     def deepl_lang(lang):
         exceptions = {
             'en_GB': 'EN-GB',
@@ -69,102 +107,359 @@ def complete_missing_translations(pofile, lang):
             return exceptions[lang]
         return lang[:2].upper()
 
-    if not lang in compendium:
+    def translate(self, texts, lang):
+        try:
+            results = self.translator.translate_text(
+                texts,
+                target_lang=self.deepl_lang(lang),
+                preserve_formatting=True,
+                formality='more',
+            )
+        except deepl.exceptions.DeepLException as e:
+            raise TranslationError(
+                "Unable to translate entries with DeepL for language %s: %s" %
+                (self.deepl_lang(lang), e)
+            )
+        return [result.text for result in results]
+
+
+class PseudoBackend(TranslationBackend):
+    name = 'pseudo'
+
+    def translate(self, texts, lang):
+        return ['[%s] %s' % (lang, text) for text in texts]
+
+
+TRANSLATION_BACKENDS = {
+    DeepLBackend.name: DeepLBackend,
+    PseudoBackend.name: PseudoBackend,
+}
+
+
+class TranslationMemory:
+    """Texts translated earlier by a backend, kept across runs."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                backend TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                msgid TEXT NOT NULL,
+                msgstr TEXT NOT NULL,
+                PRIMARY KEY (backend, lang, msgid)
+            ) WITHOUT ROWID
+        """)
+
+    def get(self, backend, lang, msgid):
+        row = self.connection.execute(
+            "SELECT msgstr FROM translations "
+            "WHERE backend = ? AND lang = ? AND msgid = ?",
+            (backend, lang, msgid)
+        ).fetchone()
+        return row[0] if row else None
+
+    def update(self, backend, lang, translations):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+            ((backend, lang, msgid, msgstr)
+             for msgid, msgstr in translations.items())
+        )
+        self.connection.commit()
+
+
+class Translator:
+    """Translates texts through the translation memory first, and sends the
+    remaining ones to the backend in batches of limited size."""
+
+    def __init__(self, backend, memory, batch_chars=20000, max_requests=2):
+        self.backend = backend
+        self.memory = memory
+        self.batch_chars = batch_chars
+        self.max_requests = max_requests
+
+    def batches(self, texts):
+        batch = []
+        size = 0
+        for text in texts:
+            if batch and size + len(text) > self.batch_chars:
+                yield batch
+                batch = []
+                size = 0
+            batch.append(text)
+            size += len(text)
+        if batch:
+            yield batch
+
+    def translate(self, texts, lang):
+        """Return a dictionary with the translation of each text, leaving out
+        the texts that could not be translated."""
+        translations = {}
+        missing = []
+        for text in dict.fromkeys(texts):
+            msgstr = self.memory.get(self.backend.name, lang, text)
+            if msgstr is None:
+                missing.append(text)
+            else:
+                translations[text] = msgstr
+        if not missing:
+            return translations
+
+        # Requests run concurrently, the memory is only written from here
+        with ThreadPoolExecutor(max_workers=self.max_requests) as executor:
+            futures = {
+                executor.submit(self.backend.translate, batch, lang): batch
+                for batch in self.batches(missing)
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    results = future.result()
+                except TranslationError as e:
+                    print(e, file=sys.stderr)
+                    continue
+                new_translations = dict(zip(batch, results))
+                self.memory.update(self.backend.name, lang, new_translations)
+                translations.update(new_translations)
+        return translations
+
+
+def complete_missing_translations(pofile, lang):
+    global arguments, compendium, translator
+
+    translations = compendium.get(lang)
+    if translations is None:
         return
 
     # Try translating with the compendium first
     for entry in pofile.untranslated_entries():
-        if entry.msgid in compendium[lang]:
-            entry.msgstr = compendium[lang][entry.msgid]
-            continue
+        msgstr = translations.get(entry.msgid)
+        if msgstr:
+            entry.msgstr = msgstr
 
-    # Translate all missing entries in one request
-    if 'use-translation-service' in arguments:
+    # Translate all remaining entries with the translation service
+    if translator:
         untranslated_entries = pofile.untranslated_entries()
         if untranslated_entries:
-            try:
-                translation_results = translator.translate_text(
-                    [entry.msgid for entry in untranslated_entries],
-                    target_lang=deepl_lang(lang),
-                    preserve_formatting=True,
-                    formality='more',
-                )
-                for i in range(len(untranslated_entries)):
-                    entry = untranslated_entries[i]
-                    result = translation_results[i]
-                    entry.msgstr = result.text
+            translation_results = translator.translate(
+                [entry.msgid for entry in untranslated_entries], lang
+            )
+            for entry in untranslated_entries:
+                if entry.msgid in translation_results:
+                    entry.msgstr = translation_results[entry.msgid]
                     print("Translated: [%s] -> [%s]" % (entry.msgid, entry.msgstr))
-            except deepl.exceptions.DeepLException as e:
-                print("Unable to translate entries with DeepL for language %s: %s" % (deepl_lang(lang), e))
 
 
-def generate_new_translations(module_name, language):
-    global arguments, temp_file
-    os.system('./run --stop-after-init --log-level error -d "%s" -l %s --modules "%s" --i18n-export "%s" ' % (
-    arguments['database'], language, module_name, temp_file))
-    return polib.pofile(temp_file)
+def export_module_terms(module_name):
+    """Export the terms of a module once, without any language. Every
+    language file is derived from this template afterwards."""
+    global arguments
+    fd, template_file = tempfile.mkstemp(
+        prefix='trans-%s-' % module_name, suffix='.po'
+    )
+    os.close(fd)
+    result = subprocess.run([
+        os.path.join(os.environ['ODOO_WORK_DIR'], 'run'),
+        '--stop-after-init', '--log-level', 'error',
+        '-d', arguments['database'], '--modules', module_name,
+        '--i18n-export', template_file,
+    ])
+    if result.returncode != 0 or not os.path.getsize(template_file):
+        os.unlink(template_file)
+        raise RuntimeError("Unable to export the terms of module %s" % module_name)
+    return template_file
+
+
+def generate_new_translations(template_file, old_translations):
+    new_translations = polib.pofile(template_file)
+    # Keep the language specific headers of the existing file
+    metadata = dict(old_translations.metadata)
+    for key in ('POT-Creation-Date', 'PO-Revision-Date'):
+        if key in new_translations.metadata:
+            metadata[key] = new_translations.metadata[key]
+    new_translations.metadata = metadata
+    return new_translations
+
+
+class Compendium:
+    """Existing Odoo translations, stored on disk in one SQLite file per
+    language. A language is only built the first time it is looked up, and
+    rebuilt when the Odoo repository is checked out at another commit."""
+
+    def __init__(self, folder, langs=None):
+        self.folder = folder
+        self.langs = langs
+        self.revision = repository_revision(folder)
+        self.languages = {}
+        self.pofiles = None
+
+    def get(self, lang):
+        if self.langs and not lang in self.langs:
+            return None
+        if not lang in self.languages:
+            self.languages[lang] = self.open_language(lang)
+        return self.languages[lang]
+
+    def find_pofiles(self):
+        # Walk the source tree only once, for all languages
+        if self.pofiles is None:
+            self.pofiles = {}
+            for subdir, dirs, files in os.walk(self.folder):
+                if '.git' in dirs:
+                    dirs.remove('.git')
+                for filename in sorted(files):
+                    if filename.endswith('.po'):
+                        self.pofiles.setdefault(filename[:-3], []).append(
+                            os.path.join(subdir, filename)
+                        )
+        return self.pofiles
+
+    def open_language(self, lang):
+        if not self.revision:
+            # Without a commit to check against, no cache can be trusted
+            print("Unable to determine the Odoo commit, loading %s "
+                  "translations in memory..." % lang, file=sys.stderr)
+            connection = sqlite3.connect(':memory:')
+            self.build_language(connection, lang)
+            return CompendiumLanguage(connection)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = os.path.join(
+            CACHE_DIR,
+            '%s-%s.sqlite' % (os.environ.get('ODOO_VERSION', 'odoo'), lang)
+        )
+        if compendium_revision(path) != self.revision:
+            print("Building compendium of existing Odoo %s translations..." %
+                  lang, file=sys.stderr)
+            # Build next to the final file, and swap it in when complete
+            fd, build_path = tempfile.mkstemp(
+                prefix='.%s-' % lang, suffix='.sqlite', dir=CACHE_DIR
+            )
+            os.close(fd)
+            connection = sqlite3.connect(build_path)
+            try:
+                self.build_language(connection, lang)
+            finally:
+                connection.close()
+            os.replace(build_path, path)
+        connection = sqlite3.connect(path)
+        if not connection.execute("SELECT 1 FROM translations LIMIT 1").fetchone():
+            connection.close()
+            return None
+        return CompendiumLanguage(connection)
+
+    def build_language(self, connection, lang):
+        connection.executescript("""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE translations (
+                msgid TEXT PRIMARY KEY, msgstr TEXT NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        for filename in self.find_pofiles().get(lang, []):
+            # The first translation found for a msgid wins
+            connection.executemany(
+                "INSERT OR IGNORE INTO translations VALUES (?, ?)",
+                ((entry.msgid, entry.msgstr)
+                 for entry in polib.pofile(filename) if entry.msgstr)
+            )
+        connection.execute(
+            "INSERT INTO meta VALUES ('revision', ?)", (self.revision,)
+        )
+        connection.commit()
+
+
+class CompendiumLanguage:
+    """Lazy msgid lookups in the compendium of a single language."""
 
+    def __init__(self, connection):
+        self.connection = connection
 
-def load_compendium(folder, langs=None):
-    dictionary = {}
+    def get(self, msgid):
+        row = self.connection.execute(
+            "SELECT msgstr FROM translations WHERE msgid = ?", (msgid,)
+        ).fetchone()
+        return row[0] if row else None
 
-    for subdir, dirs, files in os.walk(folder):
-        for filename in files:
-            if filename.endswith('.po'):
-                lang = filename[:-3]
-                if langs and not lang in langs:
-                    continue
 
-                if not lang in dictionary:
-                    dictionary[lang] = {}
-                translations = load_translations_dict(
-                    os.path.join(subdir, filename)
-                )
-                dictionary[lang] = {**translations, **dictionary[lang]}
+def compendium_revision(path):
+    if not os.path.exists(path):
+        return None
+    connection = sqlite3.connect(path)
+    try:
+        row = connection.execute(
+            "SELECT value FROM meta WHERE key = 'revision'"
+        ).fetchone()
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        connection.close()
+    return row[0] if row else None
 
-    return dictionary
 
+def repository_revision(folder):
+    try:
+        return subprocess.check_output(
+            ['git', '-C', folder, 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
 
-def load_translations_dict(filename):
-    dictionary = {}
-    translations = polib.pofile(filename)
-    for trans in translations:
-        if not trans.msgid in dictionary:
-            dictionary[trans.msgid] = trans.msgstr
-    return dictionary
+
+def entry_key(entry):
+    return (entry.msgctxt, entry.msgid)
+
+
+def fuzzy_key(msgid):
+    return ' '.join(msgid.split()).casefold()
 
 
 def merge_translations(new_translations, old_translations):
-    def find_entry(pofile, msgid):
-        for entry in pofile:
-            if entry.msgid == msgid:
-                return entry
+    # Index the old translations once, so every lookup takes constant time
+    by_key = {}
+    by_msgid = {}
+    by_fuzzy_key = {}
+    for entry in old_translations:
+        if entry.obsolete or not entry.msgstr:
+            continue
+        by_key.setdefault(entry_key(entry), entry)
+        by_msgid.setdefault(entry.msgid, entry)
+        by_fuzzy_key.setdefault(fuzzy_key(entry.msgid), entry)
 
     # Translate all missing entries
-    existing_msgids = []
+    existing_keys = set()
     for entry in new_translations.untranslated_entries():
-        old_entry = find_entry(old_translations, entry.msgid)
+        old_entry = by_key.get(entry_key(entry)) or by_msgid.get(entry.msgid)
+        fuzzy = False
+        if not old_entry:
+            # Fall back to a source text that only differs in case or spacing
+            old_entry = by_fuzzy_key.get(fuzzy_key(entry.msgid))
+            fuzzy = True
         if old_entry:
             entry.msgstr = old_entry.msgstr
-            existing_msgids.append(entry.msgid)
+            if (fuzzy or old_entry.fuzzy) and 'fuzzy' not in entry.flags:
+                entry.flags.append('fuzzy')
+            existing_keys.add(entry_key(entry))
+            existing_keys.add(entry_key(old_entry))
 
     # Append unused old entries as comments:
     for entry in old_translations.translated_entries():
-        if not entry.msgid in existing_msgids:
+        if not entry_key(entry) in existing_keys:
             entry.obsolete = True
             new_translations.append(entry)
-            existing_msgids.append(entry.msgid)
+            existing_keys.add(entry_key(entry))
     for entry in old_translations.obsolete_entries():
-        if not entry.msgid in existing_msgids:
+        if not entry_key(entry) in existing_keys:
             new_translations.append(entry)
 
 
 def parse_arguments():
     arguments = {}
 
-    optlist, args = getopt.getopt(sys.argv[1:], 'd:hm:f:l:tk:', [
-        'database=', 'help', 'module=', 'module-folder=', 'languages=',
-        'use-translation-service', 'auth-deepl-key'
+    optlist, args = getopt.getopt(sys.argv[1:], 'd:hj:m:f:l:tb:k:', [
+        'database=', 'help', 'jobs=', 'module=', 'module-folder=', 'languages=',
+        'use-translation-service', 'translation-backend=', 'batch-chars=',
+        'max-requests=', 'auth-deepl-key'
     ])
 
     for opt in optlist:
@@ -176,19 +471,27 @@ def parse_arguments():
             arguments['module-folder'] = value
         if arg == '-h' or arg == '--help':
             arguments['help'] = True
+        if arg == '-j' or arg == '--jobs':
+            arguments['jobs'] = value
         if arg == '-m' or arg == '--module':
             arguments['module'] = value
         if arg == '-l' or arg == '--languages':
             arguments['languages'] = value
         if arg == '-t' or arg == '--use-translation-service':
             arguments['use-translation-service'] = value
+        if arg == '-b' or arg == '--translation-backend':
+            arguments['translation-backend'] = value
+        if arg == '--batch-chars':
+            arguments['batch-chars'] = value
+        if arg == '--max-requests':
+            arguments['max-requests'] = value
         if arg == '-k' or arg == '--key':
             arguments['auth-deepl-key'] = value
     return arguments
 
 
 def main():
-    global arguments, compendium, deepl, temp_file, translator
+    global arguments, compendium, deepl, translator
 
     try:
         arguments = parse_arguments()
@@ -200,7 +503,11 @@ def main():
         print(HELP_TEXT)
         return 0
 
-    if 'use-translation-service' in args:
+    backend_name = args.get('translation-backend', DeepLBackend.name)
+    if not backend_name in TRANSLATION_BACKENDS:
+        print("Unknown translation backend: %s" % backend_name, file=sys.stderr)
+        return 1
+    if 'use-translation-service' in args and backend_name == DeepLBackend.name:
         import deepl
 
     # Load database name
@@ -225,65 +532,97 @@ def main():
 
     # Load translator if requested
     if 'use-translation-service' in args:
-        if 'auth-deepl-key' in args and len(args['auth-deepl-key']) > 0:
+        if backend_name != DeepLBackend.name:
+            backend = TRANSLATION_BACKENDS[backend_name]()
+        elif 'auth-deepl-key' in args and len(args['auth-deepl-key']) > 0:
             deepl_secret = args['auth-deepl-key']
-            translator = deepl.Translator(deepl_secret)
+            backend = DeepLBackend(deepl_secret)
         else:
             deepl_secret = os.environ['DEEPL_SECRET']
             if deepl_secret != '':
-                translator = deepl.Translator(deepl_secret)
+                backend = DeepLBackend(deepl_secret)
             else:
                 print("DeepL authentication key is undefined!",
                     "\n    Use -k or --key or define DEEPL_SECRET variable in .env-secret.",
                     "\n  Unable to translate missing entries!")
                 return 1
+        translator = Translator(
+            backend,
+            TranslationMemory(
+                os.path.join(CACHE_DIR, 'translation-memory.sqlite')
+            ),
+            batch_chars=int(args.get('batch-chars', 20000)),
+            max_requests=int(args.get('max-requests', 2)),
+        )
 
-    if not 'languages' in args:
-        print("Warning: no languages specified. Loading all languages, which "
-              "may take a long time. To speed up this process, specify "
-              "languages to process less like so: -l nl,de,fr",
-              file=sys.stderr)
-    langs = args['languages'] if 'languages' in args else None
+    langs = args['languages'].split(',') if 'languages' in args else None
 
     # Initialize
     # FIXME: Only works if odoo is actually placed in this directory
-    print("Loading exising Odoo translations...", file=sys.stderr)
-    compendium = load_compendium(os.path.join(ODOO_DIR), langs)
+    compendium = Compendium(ODOO_DIR, langs)
 
-    temp_file = tempfile.mkstemp(prefix='trans', suffix='.po')[1]
+    jobs = int(args['jobs']) if 'jobs' in args else min(4, os.cpu_count() or 1)
+
+    # Only start Odoo for modules that have translations to upgrade
+    module_pofiles = {}
     for module_name in addons:
         module_path = os.path.join(ADDONS_DIR, module_name)
-        upgrade_module_translations(module_name, module_path)
+        pofiles = find_module_pofiles(module_path)
+        if pofiles:
+            module_pofiles[module_name] = pofiles
+
+    # Export in parallel, but merge in this thread: the compendium and the
+    # translator are not meant to be shared between threads
+    failed = False
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = {
+            executor.submit(export_module_terms, module_name): module_name
+            for module_name in module_pofiles
+        }
+        for future in as_completed(futures):
+            module_name = futures[future]
+            try:
+                template_file = future.result()
+            except RuntimeError as e:
+                print(e, file=sys.stderr)
+                failed = True
+                continue
+            try:
+                upgrade_module_translations(
+                    module_pofiles[module_name], template_file
+                )
+            finally:
+                os.unlink(template_file)
+    return 1 if failed else 0
 
 
-def upgrade_module_translation(language, module_name, module_path, filename):
+def find_module_pofiles(module_path):
+    i18n_path = os.path.join(module_path, 'i18n')
+    if not os.path.exists(i18n_path):
+        return []
+    return [
+        os.path.join(i18n_path, filename)
+        for filename in sorted(os.listdir(i18n_path))
+        if filename.endswith('.po')
+    ]
+
+
+def upgrade_module_translation(language, filename, template_file):
     print("Processing file", filename)
-    new_translations = generate_new_translations(module_name, language)
     old_translations = polib.pofile(filename)
+    new_translations = generate_new_translations(template_file, old_translations)
     merge_translations(new_translations, old_translations)
     complete_missing_translations(new_translations, language)
-    new_translations.save()
     old_filename = filename + '.old'
     if os.path.exists(old_filename):
         os.unlink(old_filename)
     shutil.move(filename, old_filename)
-    shutil.move(temp_file, filename)
+    new_translations.save(filename)
 
-def upgrade_module_translations(module_name, module_path):
-    global temp_file
-    i18n_path = os.path.join(module_path, 'i18n')
-    if os.path.exists(i18n_path):
-        for filename in os.listdir(i18n_path):
-            if not filename.endswith('.po'):
-                continue
-            language = filename[:-3]
-            pofile_path = os.path.join(i18n_path, filename)
-            upgrade_module_translation(
-                language,
-                module_name,
-                module_path,
-                pofile_path
-            )
+def upgrade_module_translations(pofiles, template_file):
+    for pofile_path in pofiles:
+        language = os.path.basename(pofile_path)[:-3]
+        upgrade_module_translation(language, pofile_path, template_file)
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -1 +1,2 @@
+from .graph import *
 from .purge import *
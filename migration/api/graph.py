@@ -0,0 +1,46 @@
+import logging
+
+
+_logger = logging.getLogger(__name__)
+
+_ON_PATH = 1
+_DONE = 2
+
+
+def find_back_edges(edges):
+    """Find the edges that close a cycle in a directed graph.
+
+    Walks the graph with an iterative depth-first search, so every node and
+    edge is visited only once, and deep graphs don't hit the recursion limit.
+    Removing all edges that are returned makes the graph acyclic.
+
+    :param edges: Iterable of ``(edge, source, target)`` tuples, where ``edge``
+        identifies the edge, for instance by a record id.
+    :return list: The identifiers of the back edges, in the order found.
+    """
+    adjacency = {}
+    for edge, source, target in edges:
+        adjacency.setdefault(source, []).append((edge, target))
+
+    state = {}
+    back_edges = []
+    for root in adjacency:
+        if root in state:
+            continue
+        state[root] = _ON_PATH
+        stack = [(root, iter(adjacency[root]))]
+        while stack:
+            node, children = stack[-1]
+            for edge, target in children:
+                target_state = state.get(target)
+                if target_state is None:
+                    state[target] = _ON_PATH
+                    stack.append((target, iter(adjacency.get(target, ()))))
+                    break
+                if target_state == _ON_PATH:
+                    back_edges.append(edge)
+            else:
+                state[node] = _DONE
+                stack.pop()
+    _logger.debug("Found %i back edges in %i nodes.", len(back_edges), len(state))
+    return back_edges
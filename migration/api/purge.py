@@ -1,4 +1,5 @@
 from psycopg2.extensions import AsIs
+from .graph import find_back_edges
 import logging
 
 
@@ -23,6 +24,8 @@ class Purger:
         self.reset_id = reset_id
         self.skip_validation = skip_validation
         self.delete_more_than_keep = delete_more_than_keep
+        # Tables of which the triggers are disabled until stop()
+        self.disabled_tables = [table_name]
 
         self.constraints = fetch_foreign_key_constraints(self.cr, self.table_name)
         self.has_id = self._has_id()
@@ -120,6 +123,11 @@ class Purger:
                 purger.start()
                 purger.purge(filter_clause)
                 purger.clean()
+                self.disabled_tables += [
+                    table
+                    for table in purger.disabled_tables
+                    if table not in self.disabled_tables
+                ]
                 # Only clean, don't stop, because foreign_table_name might be the same as self.table_name, and we don't want to enable the foreign keys too early
                 self.cr.execute(
                     'DROP INDEX IF EXISTS "%s_temp_index"' % constraint_name
@@ -239,6 +247,9 @@ class Purger:
         if not self.delete_more_than_keep and self.has_id:
             self.cr.execute('DROP TABLE "%s_deleted"' % self.table_name)
         self.clean_foreign_references = False
+        for table_name in self.disabled_tables:
+            _logger.debug("Enabling triggers for table %s", table_name)
+            self.cr.execute("ALTER TABLE %s ENABLE TRIGGER ALL", [AsIs(table_name)])
 
     def truncate(self):
         _logger.debug("Truncating table %s", self.table_name)
@@ -334,72 +345,154 @@ def purge_records(cr, table_name, where_clause, reset_id, non_updatable_tables=[
         cr.execute("DROP TABLE yyy")
 
 
+def purge_models(env, model_names):
+    """Delete a set of models together with everything that depends on them.
+
+    All statements take the whole set of models at once, and run in the
+    transaction of the given environment. The fields of the models, and of
+    other models that relate to them, are deleted by a Purger, so that their
+    selections, relations and other references go as well. Any remaining
+    foreign references to the deleted ir_model records are cleaned up by a
+    single Purger pass.
+
+    :return dict: The number of deleted rows, per table.
+    """
+    model_names = list(model_names)
+    counts = {}
+    env.cr.execute(
+        "SELECT id, model FROM ir_model WHERE model = ANY(%s)", [model_names]
+    )
+    found = dict(env.cr.fetchall())
+    for model_name in set(model_names) - set(found.values()):
+        _logger.warning("Unable to purge model %s, model was not found", model_name)
+    if not found:
+        return counts
+    params = {"ids": list(found)}
+    queries = [
+        (
+            "ir_cron",
+            """
+            DELETE FROM ir_cron WHERE ir_actions_server_id IN (
+                SELECT id FROM ir_act_server WHERE model_id = ANY(%(ids)s)
+            )
+        """,
+        ),
+        ("ir_act_server", "DELETE FROM ir_act_server WHERE model_id = ANY(%(ids)s)"),
+        (
+            "ir_model_access",
+            "DELETE FROM ir_model_access WHERE model_id = ANY(%(ids)s)",
+        ),
+        (
+            "ir_model_constraint",
+            "DELETE FROM ir_model_constraint WHERE model = ANY(%(ids)s)",
+        ),
+        (
+            "ir_model_relation",
+            "DELETE FROM ir_model_relation WHERE model = ANY(%(ids)s)",
+        ),
+        ("ir_rule", "DELETE FROM ir_rule WHERE model_id = ANY(%(ids)s)"),
+    ]
+    for table_name, query in queries:
+        env.cr.execute(query, params)
+        counts[table_name] = env.cr.rowcount
+    # Purger takes a plain WHERE clause, and formats its queries with %
+    where_clause = env.cr.mogrify(
+        "model_id = ANY(%s) OR relation = ANY(%s)",
+        [list(found), list(found.values())],
+    )
+    if isinstance(where_clause, bytes):
+        where_clause = where_clause.decode("utf-8")
+    with Purger(env.cr, "ir_model_fields") as p:
+        p.purge(where_clause.replace("%", "%%"))
+        counts["ir_model_fields"] = env.cr.rowcount
+    with Purger(env.cr, "ir_model") as p:
+        p.purge("id IN (%s)" % ",".join(str(model_id) for model_id in found))
+        counts["ir_model"] = env.cr.rowcount
+    for table_name, count in counts.items():
+        _logger.debug("Purged %i rows from %s.", count, table_name)
+    return counts
+
+
 def purge_model(env, model_id, careful=True, model_name=None):
-    env.cr.execute("SELECT model FROM ir_model WHERE id = %s", [model_id])
     if not model_name:
+        env.cr.execute("SELECT model FROM ir_model WHERE id = %s", [model_id])
         model_name = env.cr.fetchone()[0]
-    env.cr.commit()
-    env.cr.execute(
+    return purge_models(env, [model_name])
+
+
+def purge_model_by_name(env, model_name, careful=True):
+    return purge_models(env, [model_name])
+
+
+def fetch_view_descendants(cr, view_ids):
+    """Return the given view ids together with all views inheriting from them."""
+    if not view_ids:
+        return []
+    cr.execute(
         """
-        DELETE FROM ir_cron WHERE ir_actions_server_id IN (
-            SELECT id FROM ir_act_server WHERE model_id = %s
+        WITH RECURSIVE descendants(id) AS (
+            SELECT id FROM ir_ui_view WHERE id = ANY(%s)
+            UNION
+            SELECT v.id FROM ir_ui_view AS v
+                INNER JOIN descendants AS d ON v.inherit_id = d.id
         )
+        SELECT id FROM descendants
     """,
-        [model_id],
+        [list(view_ids)],
+    )
+    return [row[0] for row in cr.fetchall()]
+
+
+def purge_views(env, view_ids):
+    """Delete the given views and all views inheriting from them in one go.
+
+    The inheritance tree is resolved with a single recursive query, after which
+    all doomed views are removed with one set-based purge.
+
+    :return list[int]: The ids of all views that were deleted.
+    """
+    doomed_ids = fetch_view_descendants(env.cr, view_ids)
+    if not doomed_ids:
+        return []
+    _logger.debug("Deleting %i views...", len(doomed_ids))
+    id_list = ",".join(str(view_id) for view_id in doomed_ids)
+    env.cr.execute(
+        "DELETE FROM ir_ui_view_group_rel WHERE view_id = ANY(%s)", [doomed_ids]
     )
-    env.cr.execute("DELETE FROM ir_act_server WHERE model_id = %s", [model_id])
-    env.cr.execute("DELETE FROM ir_model_access WHERE model_id = %s", [model_id])
-    env.cr.execute("DELETE FROM ir_model_constraint WHERE model = %s", [model_id])
+    with Purger(env.cr, "ir_ui_view") as p:
+        p.purge("id IN (%s)" % id_list)
     env.cr.execute(
-        "DELETE FROM ir_model_fields WHERE model_id = %s OR relation = %s",
-        [model_id, model_name],
+        "DELETE FROM ir_model_data WHERE model = 'ir.ui.view' AND res_id = ANY(%s)",
+        [doomed_ids],
     )
-    env.cr.execute("DELETE FROM ir_model_relation WHERE model = %s", [model_id])
-    env.cr.execute("DELETE FROM ir_rule WHERE model_id = %s", [model_id])
-    env.cr.execute("DELETE FROM ir_model WHERE id = %s", [model_id])
+    env.cr.commit()
+    return doomed_ids
 
 
-def purge_model_by_name(env, model_name, careful=True):
-    env.cr.execute("SELECT id FROM ir_model WHERE model = %s", [model_name])
-    result = env.cr.fetchone()
-    if result:
-        model_id = result[0]
-        purge_model(env, model_id, careful, model_name)
-    else:
-        logging.warning("Unable to purge model %s, model was not found", model_name)
+def purge_view(env, view_id):
+    return bool(purge_views(env, [view_id]))
 
 
-def purge_view(env, view_id):
-    def unlink_view():
-        env.cr.rollback()
-        try:
-            purge_records(env.cr, "ir_ui_view", "id = " + str(view_id))
-        except UnresolvableForeignReferenceError as e:
-            _logger.debug(
-                "Warning: unable to delete view %i: there is a foreign "
-                "reference with table %s (column %s = %s), which can't just "
-                "be deleted. Skipping this view for now..."
-                % (view_id, e.table_name, e.column_name, str(e.column_value))
-            )
-            return False
-        env.cr.execute("DELETE FROM ir_ui_view WHERE id = %s", [view_id])
-
-    env.cr.execute("SELECT id FROM ir_ui_view WHERE inherit_id = %s", [view_id])
-    result = env.cr.dictfetchall()
-    for child in result:
-        purge_view(env, child["id"])
-
-    _logger.debug("Deleting view %i..." % view_id)
-    env.cr.execute("DELETE FROM ir_ui_view_group_rel WHERE view_id = %s", [view_id])
-    try:
-        env.cr.execute("DELETE FROM ir_ui_view WHERE id = %s", [view_id])
-    except psycopg2.errors.ForeignKeyViolation:
-        unlink_view()
-    except psycopg2.errors.NotNullViolation:
-        unlink_view()
+def purge_recursive_boms(env):
+    """Remove the BoM lines that (indirectly) consume the product of their BoM.
+
+    The product templates form a graph, where each BoM line is an edge from the
+    template of its BoM to the template of its product. All lines that close a
+    cycle in this graph are deleted at once.
+
+    :return list[int]: The ids of the deleted BoM lines.
+    """
     env.cr.execute(
-        "DELETE FROM ir_model_data WHERE model = 'ir.ui.view' AND res_id = %s",
-        [view_id],
+        """
+        SELECT line.id, bom.product_tmpl_id, product.product_tmpl_id
+        FROM mrp_bom_line AS line
+            INNER JOIN mrp_bom AS bom ON bom.id = line.bom_id
+            INNER JOIN product_product AS product ON product.id = line.product_id
+        ORDER BY bom.product_tmpl_id, bom.id, line.id
+    """
     )
-    env.cr.commit()
-    return True
+    line_ids = find_back_edges(env.cr.fetchall())
+    if line_ids:
+        _logger.debug("Deleting recursive BoM lines: %s", line_ids)
+        env.cr.execute("DELETE FROM mrp_bom_line WHERE id = ANY(%s)", [line_ids])
+    return line_ids
@@ -1,13 +1,14 @@
-from migrationapi import Purger
+from migrationapi import purge_models
 
 
-env.cr.execute("SELECT id, model FROM ir_model")
-results = env.cr.dictfetchall()
+env.cr.execute("SELECT model FROM ir_model")
+existing_model_names = {row[0] for row in env.cr.fetchall()}
 
-missing_model_names = [r["model"] for r in results if r["model"] not in env]
-missing_model_ids = [str(r["id"]) for r in results if r["model"] not in env]
-logging.info("Purging models: %s", ", ".join(missing_model_names))
-with Purger(env.cr, "ir_model") as p:
-    p.purge("id IN (%s)" % ",".join(missing_model_ids))
-with Purger(env.cr, "ir_model_fields") as p:
-    p.purge("relation IN ('%s')" % "','".join(missing_model_names))
+missing_model_names = sorted(existing_model_names - set(env.registry))
+if missing_model_names:
+    logging.info("Purging models: %s", ", ".join(missing_model_names))
+    counts = purge_models(env, missing_model_names)
+    logging.info(
+        "Purged rows per table: %s",
+        ", ".join("%s: %i" % item for item in counts.items()),
+    )
@@ -1,86 +1,103 @@
 # Cleans invalid/problematic view records.
-from migrationapi import delete_table_references, UnresolvableForeignReferenceError
+#
+# All views are loaded with a single query, file-backed arches are checked
+# against a per-file parse cache, and every doomed view (including the views
+# inheriting from it) is deleted with one set-based purge at the end.
+from lxml import etree
+from migrationapi import fetch_view_descendants, purge_views
 
-try:
-    from odoo.addons.base.models.ir_ui_view import get_view_arch_from_file
-except ImportError:
-    from odoo.addons.base.ir.ir_ui_view import get_view_arch_from_file
-from odoo.exceptions import MissingError, ValidationError
+from odoo.exceptions import ValidationError
 from odoo.modules.module import get_resource_path
 
-try:
-    import psycopg2 as psycopg
-except ImportError:
-    import psycopg
 
+resource_paths = {}
+file_view_nodes = {}
 
-def delete_view(view_id):
-    def unlink_view():
-        env.cr.rollback()
+
+def get_fullpath(arch_fs):
+    """Resolve the full path of an arch_fs value, remembering the outcome."""
+    if arch_fs not in resource_paths:
+        resource_paths[arch_fs] = get_resource_path(*arch_fs.split("/"))
+    return resource_paths[arch_fs]
+
+
+def get_view_nodes(fullpath):
+    """Parse a view file once and index its view definitions by their id."""
+    if fullpath not in file_view_nodes:
+        nodes = {}
         try:
-            delete_table_references(env, "ir_ui_view", "id", view_id)
-        except UnresolvableForeignReferenceError as e:
-            logging.info(
-                "Warning: unable to delete view %i: there is a foreign "
-                "reference with table %s (column %s = %s), which can't just "
-                "be deleted. Skipping this view for now..."
-                % (view_id, e.table_name, e.column_name, str(e.column_value))
-            )
-            return False
-        env.cr.execute("DELETE FROM ir_ui_view WHERE id = %s", [view_id])
+            document = etree.parse(fullpath)
+        except (IOError, etree.XMLSyntaxError):
+            logging.info("Unable to parse %s, treating its views as missing.", fullpath)
+        else:
+            for node in document.xpath("//*[@id]"):
+                if node.tag == "template" or (
+                    node.tag == "record" and node.find("field[@name='arch']") is not None
+                ):
+                    nodes.setdefault(node.get("id"), node)
+        file_view_nodes[fullpath] = nodes
+    return file_view_nodes[fullpath]
 
-    env.cr.execute("SELECT id FROM ir_ui_view WHERE inherit_id = %s", [view_id])
-    result = env.cr.dictfetchall()
-    for child in result:
-        delete_view(child["id"])
 
-    logging.info("Deleting view %i..." % view_id)
-    env.cr.execute("DELETE FROM ir_ui_view_group_rel WHERE view_id = %s", [view_id])
-    try:
-        env.cr.execute("DELETE FROM ir_ui_view WHERE id = %s", [view_id])
-    except psycopg.errors.ForeignKeyViolation:
-        unlink_view()
-    except psycopg.errors.NotNullViolation:
-        unlink_view()
-    env.cr.execute(
-        "DELETE FROM ir_model_data WHERE model = 'ir.ui.view' AND res_id = %s",
-        [view_id],
-    )
-    env.cr.commit()
-    return True
+def arch_in_file(fullpath, xml_id):
+    """Tell whether the view with the given xml_id is defined in the file."""
+    nodes = get_view_nodes(fullpath)
+    name = xml_id.split(".", 1)[1]
+    candidates = [xml_id, name]
+    # Views created through an _inherits of ir.ui.view have their xml_id
+    # suffixed, the file only holds the id without it.
+    if name.endswith("_ir_ui_view"):
+        candidates += [xml_id[: -len("_ir_ui_view")], name[: -len("_ir_ui_view")]]
+    return any(candidate in nodes for candidate in candidates)
 
 
-def purge_views():
-    env.cr.execute("SELECT id FROM ir_ui_view WHERE name NOT LIKE 'Odoo Studio:%'")
-    result = env.cr.dictfetchall()
-    for row in result:
-        try:
-            view = env["ir.ui.view"].browse(row["id"])
-            view.arch_fs
-        except MissingError:
+def find_invalid_views():
+    """Return the ids of all views whose arch is missing or doesn't validate."""
+    env.cr.execute(
+        """
+        SELECT v.id, v.arch_fs, d.module, d.name
+        FROM ir_ui_view AS v
+            LEFT JOIN ir_model_data AS d
+                ON d.model = 'ir.ui.view' AND d.res_id = v.id
+        WHERE v.name NOT LIKE 'Odoo Studio:%' AND v.arch_fs IS NOT NULL
+        ORDER BY v.id
+    """
+    )
+    seen_ids = set()
+    missing_ids = set()
+    to_check_ids = []
+    for view_id, arch_fs, module, name in env.cr.fetchall():
+        if view_id in seen_ids:
+            # Views can have more than one xml_id
             continue
-
-        if view.arch_fs:
-            missing = False
-            fullpath = get_resource_path(*view.arch_fs.split("/"))
-            if fullpath:
-                if view.xml_id:
-                    try:
-                        arch = get_view_arch_from_file(fullpath, view.xml_id)
-                        if arch == None:
-                            missing = True
-                        else:
-                            try:
-                                view._check_xml()
-                            except ValueError:
-                                delete_view(view.id)
-                    except ValidationError:
-                        delete_view(view.id)
+        seen_ids.add(view_id)
+        fullpath = get_fullpath(arch_fs)
+        if not fullpath:
+            missing_ids.add(view_id)
+        elif module and name:
+            if arch_in_file(fullpath, "%s.%s" % (module, name)):
+                to_check_ids.append(view_id)
             else:
-                missing = True
-            if missing:
-                delete_view(view.id)
+                missing_ids.add(view_id)
+    logging.info(
+        "Found %i views with a missing arch, validating %i others...",
+        len(missing_ids),
+        len(to_check_ids),
+    )
+
+    # Views inheriting from a missing view are doomed too, no need to check them
+    doomed_ids = set(fetch_view_descendants(env.cr, list(missing_ids)))
+    invalid_ids = set()
+    views = env["ir.ui.view"].browse(
+        [view_id for view_id in to_check_ids if view_id not in doomed_ids]
+    )
+    for view in views:
+        try:
+            view._check_xml()
+        except (ValueError, ValidationError):
+            invalid_ids.add(view.id)
+    return doomed_ids | invalid_ids
 
 
-purge_views()
-logging.info("Cleaned views.")
+deleted_ids = purge_views(env, list(find_invalid_views()))
+logging.info("Cleaned views, %i views deleted.", len(deleted_ids))
@@ -1,9 +1,23 @@
 #!.venv/bin/click-odoo
+import hashlib
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from enum import IntEnum
 
+import psycopg2
+from odoo.sql_db import connection_info_for
+
 logger = logging.getLogger("index_checker")
 
+# Number of connections used to rebuild indexes in parallel
+JOBS = int(os.environ.get("FIX_INDEXES_JOBS", min(4, os.cpu_count() or 1)))
+# Missing indexes are only reported, unless they are asked to be created too:
+# on a large database that can take hours.
+CREATE_MISSING = os.environ.get("FIX_INDEXES_CREATE_MISSING", "").lower() == "true"
+
 INDEXES_TO_CHECK = {
     "base": [
         "ir_attachment_res_idx",
@@ -94,20 +108,119 @@ def has_trigram(cr):
 
 
 def generate_index_expr(
-    cr, indexname, tablename, expressions, method="btree", where=""
+    cr, indexname, tablename, expressions, method="btree", where="", concurrently=False
 ):
     """Generate index expression"""
     args = ", ".join(expressions)
     if where:
         where = f" WHERE ({where})"
-    return (
-        f"CREATE INDEX {indexname} ON public.{tablename} USING {method} ({args}){where}"
-    )
+    create = "CREATE INDEX CONCURRENTLY" if concurrently else "CREATE INDEX"
+    return f"{create} {indexname} ON public.{tablename} USING {method} ({args}){where}"
 
 
 def get_index_expr(cr, indexname):
     cr.execute("SELECT indexdef FROM pg_indexes WHERE indexname = %s", (indexname,))
-    return cr.fetchone()[0]
+    result = cr.fetchone()
+    return result and result[0]
+
+
+def get_indexed_columns(cr, tablenames):
+    """Return the column lists of all indexes on the given tables, per table."""
+    cr.execute(
+        """
+        SELECT t.relname, array_agg(a.attname::text ORDER BY k.n)
+        FROM pg_index i
+            JOIN pg_class t ON t.oid = i.indrelid
+            CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, n)
+            JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+        WHERE t.relname IN %s
+        GROUP BY i.indexrelid, t.relname
+    """,
+        [tuple(tablenames)],
+    )
+    result = {}
+    for tablename, columns in cr.fetchall():
+        result.setdefault(tablename, []).append(columns)
+    return result
+
+
+class IndexRebuilder:
+    """Rebuild indexes with CREATE INDEX CONCURRENTLY on a pool of connections.
+
+    Each index is built under a temporary name without blocking writes to its
+    table, and then swapped in place of the old index in a short transaction.
+    """
+
+    def __init__(self, dbname, max_len, jobs=JOBS):
+        self.connection_info = connection_info_for(dbname)[1]
+        self.max_len = max_len
+        self.jobs = max(jobs, 1)
+        self.connections = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def _get_connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = psycopg2.connect(**self.connection_info)
+            connection.autocommit = True
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def rebuild(self, indexname, tablename, expressions, method="btree", where=""):
+        """Build a single index concurrently and swap it in."""
+        # Unique for long names that only differ after the truncation
+        digest = hashlib.sha1(indexname.encode("utf-8")).hexdigest()[:8]
+        temp_name = f"{indexname[: self.max_len - 13]}_{digest}_new"
+        started = time.time()
+        with self._get_connection().cursor() as cr:
+            # A failed earlier attempt may have left an invalid index behind
+            cr.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {temp_name}")
+            cr.execute(
+                generate_index_expr(
+                    cr, temp_name, tablename, expressions, method, where, True
+                )
+            )
+            cr.execute("BEGIN")
+            try:
+                cr.execute(f"DROP INDEX IF EXISTS {indexname}")
+                cr.execute(f"ALTER INDEX {temp_name} RENAME TO {indexname}")
+                cr.execute("COMMIT")
+            except Exception:
+                cr.execute("ROLLBACK")
+                raise
+            cr.execute(
+                "SELECT pg_size_pretty(pg_relation_size(%s::regclass))", [indexname]
+            )
+            size = cr.fetchone()[0]
+        return time.time() - started, size
+
+    def rebuild_all(self, repairs):
+        """Rebuild all given indexes, return the names of those that failed."""
+        failed = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = {
+                    executor.submit(self.rebuild, *repair): repair[0]
+                    for repair in repairs
+                }
+                for future in as_completed(futures):
+                    indexname = futures[future]
+                    try:
+                        duration, size = future.result()
+                    except psycopg2.Error as e:
+                        logger.error("Failed to rebuild index %s: %s", indexname, e)
+                        failed.append(indexname)
+                    else:
+                        logger.info(
+                            "Rebuilt index %s in %.1fs (%s)", indexname, duration, size
+                        )
+        finally:
+            for connection in self.connections:
+                connection.close()
+        return failed
 
 
 def get_unaccent_wrapper(x):
@@ -161,6 +274,8 @@ env.cr.execute(
     [tuple(row[0] for row in expected)],
 )
 existing = dict(env.cr.fetchall())
+repairs = []
+missing = []
 for indexname, tablename, field, unaccent in expected:
     column_expression = f"{field.name}"
     index = field.index
@@ -178,6 +293,7 @@ for indexname, tablename, field, unaccent in expected:
         )
     ):
         logger.warning("Missing index %s", indexname)
+        missing.append(indexname)
 
     # check index definition
     if index and (
@@ -206,12 +322,51 @@ for indexname, tablename, field, unaccent in expected:
         expected_expr = generate_index_expr(
             env.cr, indexname, tablename, [expression], method, where
         )
-        if expr != expected_expr:
-            logger.warning("Index not as expected!")
-            logger.warning(f"Used index: {expr}")
-            logger.warning(f"Expected index: {expected_expr}")
-            env.cr.execute(f"DROP INDEX {indexname}")
-            env.cr.execute(expected_expr)
-
-# check automatic _rel indexes
-# TODO
+        if expr != expected_expr and (expr or CREATE_MISSING):
+            if expr:
+                logger.warning("Index not as expected!")
+                logger.warning(f"Used index: {expr}")
+                logger.warning(f"Expected index: {expected_expr}")
+            repairs.append((indexname, tablename, [expression], method, where))
+
+# check automatic _rel indexes: Odoo creates many2many tables with a primary
+# key on (column1, column2), and an index on (column2, column1).
+relations = {
+    field.relation: (field.column1, field.column2)
+    for model_name in model_names
+    for Model in [env[model_name]]
+    if Model._auto and not Model._abstract
+    for field in Model._fields.values()
+    if field.type == "many2many" and field.store and field.relation
+}
+if relations:
+    indexed_columns = get_indexed_columns(env.cr, relations)
+    for relation, (column1, column2) in sorted(relations.items()):
+        if relation not in indexed_columns:
+            # The table doesn't exist (yet)
+            continue
+        # The relation may be defined from either side, so check both orders
+        for columns in ([column1, column2], [column2, column1]):
+            if any(cols[:2] == columns for cols in indexed_columns[relation]):
+                continue
+            indexname = f"{relation}_{columns[0]}_{columns[1]}_idx"[:max_len]
+            logger.warning("Missing index %s", indexname)
+            missing.append(indexname)
+            if CREATE_MISSING:
+                repairs.append((indexname, relation, columns, "btree", ""))
+
+# Rebuild all wrong indexes, and the missing ones if asked, without holding
+# any locks or snapshots in our own transaction that the concurrent builds
+# would wait for.
+env.cr.commit()
+if missing and not CREATE_MISSING:
+    logger.warning(
+        "Not creating %i missing indexes, set FIX_INDEXES_CREATE_MISSING=true "
+        "to create them as well.",
+        len(missing),
+    )
+if repairs:
+    logger.info("Rebuilding %i indexes using %i connections...", len(repairs), JOBS)
+    failed = IndexRebuilder(env.cr.dbname, max_len).rebuild_all(repairs)
+    if failed:
+        logger.error("Unable to rebuild indexes: %s", ", ".join(sorted(failed)))
@@ -1,6 +1,7 @@
 # Install all the modules listed in
 # etc/install-modules.txt
 import logging
+import time
 import traceback
 
 
@@ -24,21 +25,84 @@ except Exception as e:
     traceback.print_exc()
     raise SystemExit(1)
 
-module_count = 0
-for line in file:
-    module_name = line.strip()
-    if module_name:
-        module_count += 1
 
-logging.info("Installing %i modules..." % module_count)
-file.seek(0)
+class ModuleLoadTimer(logging.Handler):
+    """Measure how long Odoo spends loading each module, based on its logs.
+
+    Only the messages that Odoo logs at INFO for the modules it installs are
+    used, so that no logger levels need changing. Their text differs between
+    versions, when none match there are no timings.
+    """
+
+    LOGGERS = ("odoo.modules", "openerp.modules")
+    MESSAGES = (
+        # 13.0 and later
+        "Loading module %s (%d/%d)",
+        # Before, when the tables of the module are created
+        "module %s: creating or updating database tables",
+    )
+
+    def __init__(self):
+        super(ModuleLoadTimer, self).__init__()
+        self.timings = {}
+        self.current = None
+
+    def filter(self, record):
+        return record.msg in self.MESSAGES and bool(record.args)
+
+    def emit(self, record):
+        self.stop(record.created)
+        self.current = (record.args[0], record.created)
+
+    def stop(self, timestamp=None):
+        if self.current:
+            module_name, started = self.current
+            elapsed = (timestamp or time.time()) - started
+            self.timings[module_name] = self.timings.get(module_name, 0.0) + elapsed
+            self.current = None
+
+
+module_names = []
 for line in file:
     module_name = line.strip()
     if module_name and not module_name.startswith("#"):
-        module = env["ir.module.module"].search([("name", "=", module_name)])
-        if module and module.state != "installed":
-            logging.info("Installing %s..." % module_name)
-            module.button_immediate_install()
-        else:
-            logging.info("Module %s is already installed!" % module_name)
+        module_names.append(module_name)
+file.close()
+
+modules = env["ir.module.module"].search([("name", "in", module_names)])
+found_names = set(modules.mapped("name"))
+missing_names = [name for name in module_names if name not in found_names]
+to_install = modules.filtered(lambda module: module.state != "installed")
+for module in modules - to_install:
+    logging.info("Module %s is already installed!" % module.name)
+
+if to_install:
+    install_names = sorted(to_install.mapped("name"))
+    logging.info(
+        "Installing %i modules: %s" % (len(install_names), ", ".join(install_names))
+    )
+    timer = ModuleLoadTimer()
+    for logger_name in timer.LOGGERS:
+        logging.getLogger(logger_name).addHandler(timer)
+    started = time.time()
+    try:
+        # Marks all modules (and their dependencies) as 'to install', and
+        # loads the registry only once for all of them.
+        to_install.button_immediate_install()
+    finally:
+        timer.stop()
+        for logger_name in timer.LOGGERS:
+            logging.getLogger(logger_name).removeHandler(timer)
+    logging.info("Installed modules in %.1fs." % (time.time() - started))
+    if not timer.timings:
+        logging.info("Odoo logged no loading of single modules, no timings per module.")
+    for module_name, seconds in sorted(
+        timer.timings.items(), key=lambda item: item[1], reverse=True
+    ):
+        logging.info("  %-50s %7.2fs" % (module_name, seconds))
+
+if missing_names:
+    logging.warning(
+        "The following modules could not be found: %s" % ", ".join(missing_names)
+    )
 logging.info("Done installing modules.")
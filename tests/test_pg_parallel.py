@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Tests of bin/pg-parallel, against stand-in pg_dump and pg_restore programs
+that record how they are called."""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+PG_PARALLEL = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin", "pg-parallel"
+)
+
+# Records its arguments, one per line, and makes the folder of a --file=
+STAND_IN = """#!/bin/sh
+{ echo "$(basename "$0")"; for arg in "$@"; do echo "$arg"; done; echo; } >> "$CALLS"
+for arg in "$@"; do
+  case "$arg" in
+    --file=*) mkdir -p "${arg#--file=}" && echo dump > "${arg#--file=}/toc.dat" ;;
+  esac
+done
+"""
+
+
+class PgParallelTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.links = os.path.join(self.tmp, "links")
+        self.programs = os.path.join(self.tmp, "programs")
+        os.mkdir(self.links)
+        os.mkdir(self.programs)
+        for program in ("pg_dump", "pg_restore"):
+            os.symlink(PG_PARALLEL, os.path.join(self.links, program))
+            path = os.path.join(self.programs, program)
+            with open(path, "w") as fh:
+                fh.write(STAND_IN)
+            os.chmod(path, 0o755)
+        self.calls = os.path.join(self.tmp, "calls")
+        self.env = dict(
+            os.environ,
+            CALLS=self.calls,
+            PATH=os.pathsep.join([self.links, self.programs, os.environ["PATH"]]),
+            PG_PARALLEL_JOBS="8",
+        )
+        self.env.pop("PG_PARALLEL_DUMP_CACHE", None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def run_program(self, program, *args):
+        subprocess.check_call(
+            [sys.executable, os.path.join(self.links, program)] + list(args),
+            env=self.env,
+            cwd=self.tmp,
+        )
+
+    def recorded_calls(self):
+        """The calls of the stand-ins, as lists of the program and arguments."""
+        if not os.path.exists(self.calls):
+            return []
+        with open(self.calls) as fh:
+            return [call.split("\n") for call in fh.read().split("\n\n") if call]
+
+    def test_restore_gets_the_jobs(self):
+        self.run_program("pg_restore", "-j", "2", "-d", "db", "--no-owner", "dump")
+        self.assertEqual(
+            self.recorded_calls(),
+            [["pg_restore", "--dbname=db", "--no-owner", "dump", "--jobs=8"]],
+        )
+
+    def test_directory_dump_gets_the_jobs(self):
+        self.run_program("pg_dump", "-Fd", "-fout", "db")
+        self.assertEqual(
+            self.recorded_calls(),
+            [["pg_dump", "--format=d", "--file=out", "db", "--jobs=8"]],
+        )
+
+    def test_other_formats_pass_through(self):
+        self.run_program("pg_dump", "-Fc", "-f", "out.dump", "-j", "2", "db")
+        self.run_program("pg_restore", "-1", "-d", "db", "out.dump")
+        self.assertEqual(
+            self.recorded_calls(),
+            [
+                ["pg_dump", "-Fc", "-f", "out.dump", "-j", "2", "db"],
+                ["pg_restore", "-1", "-d", "db", "out.dump"],
+            ],
+        )
+
+    def test_dump_cache_is_reused(self):
+        self.env["PG_PARALLEL_DUMP_CACHE"] = os.path.join(self.tmp, "cache")
+        os.mkdir(self.env["PG_PARALLEL_DUMP_CACHE"])
+        self.run_program("pg_dump", "--format=directory", "--file=first", "db")
+        self.run_program("pg_dump", "--format=directory", "--file=second", "db")
+        self.assertEqual(len(self.recorded_calls()), 1)
+        for target in ("first", "second"):
+            with open(os.path.join(self.tmp, target, "toc.dat")) as fh:
+                self.assertEqual(fh.read(), "dump\n")
+        # Another database is another dump
+        self.run_program("pg_dump", "--format=directory", "--file=third", "other")
+        self.assertEqual(len(self.recorded_calls()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
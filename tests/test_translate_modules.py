@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Tests of bin/translate-modules.py, translating with the pseudo backend."""
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import polib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ODOO_VERSION", "16.0")
+spec = importlib.util.spec_from_file_location(
+    "translate_modules", os.path.join(ROOT, "bin", "translate-modules.py")
+)
+translate_modules = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(translate_modules)
+
+
+class CountingBackend(translate_modules.PseudoBackend):
+    """The pseudo backend, counting the texts that it is asked for."""
+
+    def __init__(self):
+        self.texts = []
+
+    def translate(self, texts, lang):
+        self.texts.extend(texts)
+        return super().translate(texts, lang)
+
+
+class TranslateModulesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.memory_path = os.path.join(self.tmp, "memory", "memory.sqlite")
+        # Not a repository, so the compendium is built in memory, and empty
+        odoo_dir = os.path.join(self.tmp, "odoo")
+        os.mkdir(odoo_dir)
+        translate_modules.compendium = translate_modules.Compendium(odoo_dir)
+        self.template_file = os.path.join(self.tmp, "module.pot")
+        template = polib.POFile()
+        for msgid in ("Customer", "Invoice", "Due date"):
+            template.append(polib.POEntry(msgid=msgid, msgstr=""))
+        template.save(self.template_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def merge(self):
+        """Upgrade a nl.po that has one translation, in a new run."""
+        backend = CountingBackend()
+        translate_modules.translator = translate_modules.Translator(
+            backend, translate_modules.TranslationMemory(self.memory_path)
+        )
+        pofile_path = os.path.join(self.tmp, "nl.po")
+        pofile = polib.POFile()
+        pofile.append(polib.POEntry(msgid="Customer", msgstr="Klant"))
+        pofile.save(pofile_path)
+        translate_modules.upgrade_module_translation(
+            "nl", pofile_path, self.template_file
+        )
+        translations = {
+            entry.msgid: entry.msgstr for entry in polib.pofile(pofile_path)
+        }
+        return backend, translations
+
+    def test_merge_reuses_the_memory(self):
+        expected = {
+            "Customer": "Klant",
+            "Invoice": "[nl] Invoice",
+            "Due date": "[nl] Due date",
+        }
+        backend, translations = self.merge()
+        self.assertEqual(translations, expected)
+        self.assertEqual(sorted(backend.texts), ["Due date", "Invoice"])
+
+        backend, translations = self.merge()
+        self.assertEqual(translations, expected)
+        self.assertEqual(backend.texts, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
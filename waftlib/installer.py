@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import os
+import sys
 from dotenv import load_dotenv
 from collections import OrderedDict
 from os.path import exists
@@ -13,15 +15,27 @@ load_dotenv(os.path.join(os.environ["ODOO_WORK_DIR"], ".env-default"))
 load_dotenv(os.path.join(os.environ["ODOO_WORK_DIR"], ".env-shared"), override=True)
 load_dotenv(os.path.join(os.environ["ODOO_WORK_DIR"], ".env-secret"), override=True)
 
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "waft", "installer")
+
+
 class Installer(object):
-    """Base class to install packages with some package system."""
+    """Base class to install packages with some package system.
 
+    All given requirement files are installed with a single command. A
+    digest of them, and of the environment they are installed into, is
+    recorded after a successful install, so installing the same
+    requirements again is skipped.
+    """
+
+    _cache_options = []
     _cleanup_commands = []
     _install_command = None
     _remove_command = None
+    _state_dir = CACHE_DIR
 
-    def __init__(self, file_path):
-        self.file_path = file_path
+    def __init__(self, *file_paths):
+        self.file_paths = file_paths
+        self.file_path = ", ".join(file_paths)
         self._requirements = self.requirements()
 
     def _run_command(self, command):
@@ -33,40 +47,108 @@ class Installer(object):
         for command in self._cleanup_commands:
             self._run_command(command)
 
-    def install(self):
-        """Install the requirements from the given file."""
-        if self._requirements:
-            return not self._run_command(self._install_command + self._requirements)
-        else:
+    def _target(self):
+        """The installing executable and interpreter, which tell the
+        environment that the requirements are installed into."""
+        executable = self._install_command[0]
+        for path_dir in os.environ.get("PATH", "").split(os.pathsep):
+            path = os.path.join(path_dir, executable)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                executable = os.path.realpath(path)
+                break
+        return "\0".join([executable, sys.prefix, sys.version])
+
+    def _digest(self):
+        """Digest of the install command, its target and of the requirement
+        files."""
+        digest = hashlib.sha256()
+        digest.update(repr(self._install_command + self._cache_options).encode("utf-8"))
+        digest.update(b"\0" + self._target().encode("utf-8"))
+        for file_path in self.file_paths:
+            digest.update(b"\0" + file_path.encode("utf-8") + b"\0")
+            try:
+                with open(file_path, "rb") as fh:
+                    digest.update(fh.read())
+            except IOError:
+                pass
+        return digest.hexdigest()
+
+    def _state_path(self):
+        """Where the digest of the last successful install is recorded."""
+        key = hashlib.sha1(
+            "\0".join((self._target(),) + self.file_paths).encode("utf-8")
+        ).hexdigest()
+        return os.path.join(
+            self._state_dir, "%s-%s.sha256" % (type(self).__name__, key[:12])
+        )
+
+    def installed(self):
+        """Tell whether these requirements were installed already."""
+        try:
+            with open(self._state_path(), "r") as fh:
+                return fh.read().strip() == self._digest()
+        except IOError:
+            return False
+
+    def install(self, force=False):
+        """Install the requirements from the given files."""
+        if not self._requirements:
             logger.info("No installable requirements found in %s", self.file_path)
-        return False
+            return False
+        if not force and self.installed():
+            logger.info("Requirements from %s already installed", self.file_path)
+            return False
+        self._run_command(
+            self._install_command + self._cache_options + self._requirements
+        )
+        state_path = self._state_path()
+        if not exists(os.path.dirname(state_path)):
+            os.makedirs(os.path.dirname(state_path))
+        with open(state_path, "w") as fh:
+            fh.write(self._digest())
+        return True
 
     def remove(self):
         """Uninstall the requirements from the given file."""
         if not self._remove_command:
             return
         if self._requirements:
+            # Even a partial removal makes the recorded install stale
+            try:
+                os.remove(self._state_path())
+            except OSError:
+                pass
             self._run_command(self._remove_command + self._requirements)
         else:
             logger.info("No removable requirements found in %s", self.file_path)
 
     def requirements(self):
-        """Get a list of requirements from the given file."""
+        """Get a list of requirements from the given files."""
         requirements = []
-        try:
-            with open(self.file_path, "r") as fh:
-                for line in fh:
-                    line = line.strip()
-                    if not line or line.startswith("#"):
-                        continue
-                    requirements += line.split()
-        except IOError:
-            # No requirements file
-            pass
+        for file_path in self.file_paths:
+            try:
+                with open(file_path, "r") as fh:
+                    for line in fh:
+                        line = line.strip()
+                        if not line or line.startswith("#"):
+                            continue
+                        for requirement in line.split():
+                            if requirement not in requirements:
+                                requirements.append(requirement)
+            except IOError:
+                # No requirements file
+                pass
         return requirements
 
 
 class AptInstaller(Installer):
+    # Keep downloaded packages, the cleanup only drops the package lists
+    _cache_options = [
+        "-o",
+        "Dir::Cache::Archives=%s" % os.path.join(CACHE_DIR, "apt"),
+        "-o",
+        "APT::Keep-Downloaded-Packages=true",
+    ]
     _cleanup_commands = [["apt-get", "-y", "autoremove"], "rm -Rf /var/lib/apt/lists/*"]
     _install_command = [
         "apt-get",
@@ -87,10 +169,16 @@ class AptInstaller(Installer):
         if self._dirty():
             super(AptInstaller, self).cleanup()
 
-    def install(self):
-        if not self._dirty() and self._requirements:
+    def install(self, force=False):
+        if (
+            not self._dirty()
+            and self._requirements
+            and (force or not self.installed())
+        ):
             self._run_command(["apt-get", "update"])
-        return super(AptInstaller, self).install()
+        if not exists(os.path.join(CACHE_DIR, "apt", "partial")):
+            os.makedirs(os.path.join(CACHE_DIR, "apt", "partial"))
+        return super(AptInstaller, self).install(force)
 
 
 class GemInstaller(Installer):
@@ -99,16 +187,24 @@ class GemInstaller(Installer):
 
 
 class NpmInstaller(Installer):
+    _cache_options = ["--cache", os.path.join(CACHE_DIR, "npm")]
     _cleanup_commands = ["rm -Rf ~/.npm /tmp/*"]
     _install_command = ["npm", "install", "-g"]
 
 
 class PipInstaller(Installer):
-    _install_command = ["pip", "install", "--no-cache-dir", "-r"]
+    _cache_options = ["--cache-dir", os.path.join(CACHE_DIR, "pip")]
+    _install_command = ["pip", "install"]
+    # Inside the virtual environment, so that a new one installs again
+    _state_dir = os.path.join(sys.prefix, ".waft-installer")
 
     def requirements(self):
         """Pip will use its ``--requirements`` feature."""
-        return [self.file_path] if exists(self.file_path) else []
+        requirements = []
+        for file_path in self.file_paths:
+            if exists(file_path):
+                requirements += ["-r", file_path]
+        return requirements
 
 
 INSTALLERS = OrderedDict(
@@ -121,6 +217,6 @@ INSTALLERS = OrderedDict(
 )
 
 
-def install(installer, file_path):
-    """Perform a given type of installation from a given file."""
-    return INSTALLERS[installer](file_path).install()
+def install(installer, *file_paths):
+    """Perform a given type of installation from the given files."""
+    return INSTALLERS[installer](*file_paths).install()